@@ -0,0 +1,276 @@
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+from pymongo import monitoring
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+from collections import Counter
+from contextlib import contextmanager
+import sys
+import time
+import random
+import asyncio
+import functools
+import threading
+import contextvars
+
+PROFILING_PATH_PREFIX = "/api/admin/profiling"
+UNMATCHED_ROUTE_KEY = "<unmatched>"
+
+_profiled_request = contextvars.ContextVar("profiled_request", default=None)
+_endpoint_marks = contextvars.ContextVar("endpoint_marks", default=None)
+
+class ProfilingSession:
+    SAMPLE_INTERVAL = 0.01
+    LOOP_LAG_INTERVAL = 0.05
+
+    def __init__(self, app, sample_rate: float, route: Optional[str], duration_seconds: int):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.route = route
+        self.duration_seconds = duration_seconds
+        self.started_at = datetime.now(timezone.utc)
+        self.expires_at = self.started_at + timedelta(seconds=duration_seconds)
+        self._deadline = time.monotonic() + duration_seconds
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._loop = None
+        self._loop_thread_id = None
+        self._lag_task = None
+        self.sampled_requests = 0
+        self.idle_samples = 0
+        self.stacks = Counter()
+        self.sections = {}
+        self.routes = {}
+        self.loop_lag = []
+
+    @property
+    def active(self) -> bool:
+        return not self._stopped.is_set() and time.monotonic() < self._deadline
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        threading.Thread(target=self._sample_stacks, name="request-profiler", daemon=True).start()
+        self._lag_task = asyncio.create_task(self._monitor_loop_lag())
+
+    def stop(self):
+        self._stopped.set()
+
+    def select(self, scope) -> Optional[str]:
+        if scope["path"].startswith(PROFILING_PATH_PREFIX):
+            return None
+        if self.route is None:
+            if random.random() >= self.sample_rate:
+                return None
+            return self._route_key(scope, self._route_path(scope))
+        route_path = self._route_path(scope)
+        if route_path != self.route or random.random() >= self.sample_rate:
+            return None
+        return self._route_key(scope, route_path)
+
+    def _route_path(self, scope) -> Optional[str]:
+        for route in self.app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return None
+
+    @staticmethod
+    def _route_key(scope, route_path: Optional[str]) -> str:
+        # Unmatched requests share one key so junk URLs cannot grow the stats.
+        if route_path is None:
+            return UNMATCHED_ROUTE_KEY
+        return f"{scope['method']} {route_path}"
+
+    def request_started(self, task, route_key: str):
+        with self._lock:
+            self._tasks[task] = route_key
+            self.sampled_requests += 1
+
+    def request_finished(self, task, route_key: str, elapsed: float):
+        with self._lock:
+            self._tasks.pop(task, None)
+            self._record(self.routes, route_key, elapsed)
+
+    def record_section(self, name: str, elapsed: float):
+        with self._lock:
+            self._record(self.sections, name, elapsed)
+
+    @staticmethod
+    def _record(stats: dict, key: str, elapsed: float):
+        entry = stats.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+    def _sample_stacks(self):
+        while not self._stopped.wait(self.SAMPLE_INTERVAL) and self.active:
+            if not self._tasks:
+                continue
+            # Attribute the loop thread's stack to whichever task is running on it.
+            # No task means the loop is idle in the selector wait; tasks of requests
+            # that were not sampled are skipped so they never leak into the profile.
+            task = asyncio.current_task(self._loop)
+            if task is None:
+                with self._lock:
+                    self.idle_samples += 1
+                continue
+            route_key = self._tasks.get(task)
+            if route_key is None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if asyncio.current_task(self._loop) is not task:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            stack.append(route_key)
+            with self._lock:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    async def _monitor_loop_lag(self):
+        while self.active:
+            start = time.perf_counter()
+            await asyncio.sleep(self.LOOP_LAG_INTERVAL)
+            self.loop_lag.append(max(time.perf_counter() - start - self.LOOP_LAG_INTERVAL, 0.0))
+
+    def collapsed_stacks(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        def to_ms(stats):
+            return {
+                key: {
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "avg_ms": round(total * 1000 / count, 3),
+                    "max_ms": round(peak * 1000, 3),
+                }
+                for key, (count, total, peak) in stats.items()
+            }
+
+        with self._lock:
+            lag = sorted(self.loop_lag)
+            return {
+                "active": self.active,
+                "sample_rate": self.sample_rate,
+                "route": self.route,
+                "started_at": self.started_at,
+                "expires_at": self.expires_at,
+                "sampled_requests": self.sampled_requests,
+                "stack_samples": sum(self.stacks.values()),
+                "idle_samples": self.idle_samples,
+                "sections": to_ms(self.sections),
+                "routes": to_ms(self.routes),
+                "loop_lag": {
+                    "samples": len(lag),
+                    "avg_ms": round(sum(lag) * 1000 / len(lag), 3) if lag else 0.0,
+                    "p99_ms": round(lag[int(len(lag) * 0.99)] * 1000, 3) if lag else 0.0,
+                    "max_ms": round(lag[-1] * 1000, 3) if lag else 0.0,
+                },
+            }
+
+class RequestProfiler:
+    def __init__(self):
+        self.session: Optional[ProfilingSession] = None
+
+    def start(self, app, sample_rate: float, route: Optional[str], duration_seconds: int) -> ProfilingSession:
+        if self.session is not None:
+            self.session.stop()
+        self.session = ProfilingSession(app, sample_rate, route, duration_seconds)
+        self.session.start()
+        return self.session
+
+profiler = RequestProfiler()
+
+@contextmanager
+def profiled_section(name: str):
+    session = _profiled_request.get()
+    if session is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        session.record_section(name, time.perf_counter() - start)
+
+# pymongo only takes listeners at client creation, so this stays registered
+# while profiling is off; command events are still published and discarded here.
+class MongoProfilingListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        session = _profiled_request.get()
+        if session is not None:
+            session.record_section(f"mongo.{event.command_name}", event.duration_micros / 1_000_000)
+
+    failed = succeeded
+
+def _mark_endpoint_end(endpoint):
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+        marks = _endpoint_marks.get()
+        if marks is not None:
+            marks["endpoint_end"] = time.perf_counter()
+        return result
+    wrapper._profiling_wrapped = True
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    # Serialization is timed from the endpoint returning to the route handler
+    # producing its response: response_model validation, jsonable encoding and
+    # the response class render all happen in between. FastAPI resolves string
+    # annotations against the wrapper's __globals__ (this module), so wrapped
+    # endpoints must use real annotation objects, not forward-reference strings.
+    # include_router rebuilds routes from the already wrapped endpoint, hence
+    # the marker check to avoid wrapping twice.
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "_profiling_wrapped", False):
+            endpoint = _mark_endpoint_end(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            session = _profiled_request.get()
+            if session is None:
+                return await handler(request)
+            marks = {}
+            token = _endpoint_marks.set(marks)
+            try:
+                response = await handler(request)
+            finally:
+                _endpoint_marks.reset(token)
+            if "endpoint_end" in marks:
+                session.record_section("serialization", time.perf_counter() - marks["endpoint_end"])
+            return response
+
+        return profiled_handler
+
+class RequestProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = profiler.session
+        if scope["type"] != "http" or session is None or not session.active:
+            return await self.app(scope, receive, send)
+        route_key = session.select(scope)
+        if route_key is None:
+            return await self.app(scope, receive, send)
+        task = asyncio.current_task()
+        token = _profiled_request.set(session)
+        session.request_started(task, route_key)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.request_finished(task, route_key, time.perf_counter() - start)
+            _profiled_request.reset(token)
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -14,16 +15,24 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 import resend
 import asyncio
+from profiling import (
+    PROFILING_PATH_PREFIX,
+    MongoProfilingListener,
+    ProfiledRoute,
+    RequestProfilingMiddleware,
+    profiled_section,
+    profiler,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoProfilingListener()])
 db = client[os.environ['DB_NAME']]
 
 app = FastAPI()
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=ProfiledRoute)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -202,6 +211,11 @@ class InquiryCreate(BaseModel):
 class InquiryStatusUpdate(BaseModel):
     status: str
 
+class ProfilingStart(BaseModel):
+    sample_rate: Optional[float] = Field(default=None, gt=0, le=1)
+    route: Optional[str] = None
+    duration_seconds: int = Field(default=60, gt=0, le=3600)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -210,20 +224,21 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    with profiled_section("get_current_user"):
+        try:
+            token = credentials.credentials
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise HTTPException(status_code=401, detail="Invalid token")
+            user = await db.admin_users.find_one({"email": email}, {"_id": 0})
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            if isinstance(user['created_at'], str):
+                user['created_at'] = datetime.fromisoformat(user['created_at'])
+            return AdminUser(**user)
+        except JWTError:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.admin_users.find_one({"email": email}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        if isinstance(user['created_at'], str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
-        return AdminUser(**user)
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
 
 @api_router.post("/auth/register", response_model=Token)
 async def register(user_data: AdminUserCreate):
@@ -231,7 +246,8 @@ async def register(user_data: AdminUserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = pwd_context.hash(user_data.password)
+    with profiled_section("bcrypt"):
+        hashed_password = pwd_context.hash(user_data.password)
     user = AdminUser(email=user_data.email, name=user_data.name)
     user_dict = user.model_dump()
     user_dict['created_at'] = user_dict['created_at'].isoformat()
@@ -248,7 +264,9 @@ async def login(user_data: AdminUserLogin):
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not pwd_context.verify(user_data.password, user['password']):
+    with profiled_section("bcrypt"):
+        password_valid = pwd_context.verify(user_data.password, user['password'])
+    if not password_valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if isinstance(user['created_at'], str):
@@ -593,8 +611,46 @@ async def get_stats(current_user: AdminUser = Depends(get_current_user)):
         "blog_posts": blog_posts_count
     }
 
+@api_router.post("/admin/profiling")
+async def start_profiling(config: ProfilingStart, current_user: AdminUser = Depends(get_current_user)):
+    if config.route and (
+        config.route.startswith(PROFILING_PATH_PREFIX)
+        or not any(getattr(route, "path", None) == config.route for route in app.router.routes)
+    ):
+        raise HTTPException(status_code=400, detail="Unknown route")
+    sample_rate = config.sample_rate
+    if sample_rate is None:
+        sample_rate = 1.0 if config.route else 0.1
+    session = profiler.start(app, sample_rate, config.route, config.duration_seconds)
+    logger.info(f"Request profiling started by {current_user.email} for {config.duration_seconds}s")
+    return session.summary()
+
+@api_router.get("/admin/profiling")
+async def get_profiling(current_user: AdminUser = Depends(get_current_user)):
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return profiler.session.summary()
+
+@api_router.get("/admin/profiling/flamegraph", response_class=PlainTextResponse)
+async def download_flamegraph(current_user: AdminUser = Depends(get_current_user)):
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return PlainTextResponse(
+        profiler.session.collapsed_stacks(),
+        headers={"Content-Disposition": f"attachment; filename=profile-{profiler.session.started_at:%Y%m%dT%H%M%S}.folded"}
+    )
+
+@api_router.delete("/admin/profiling")
+async def stop_profiling(current_user: AdminUser = Depends(get_current_user)):
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    profiler.session.stop()
+    return {"message": "Profiling stopped successfully"}
+
 app.include_router(api_router)
 
+app.add_middleware(RequestProfilingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,